@@ -3,11 +3,14 @@ FastAPI Server with WebSocket support for real-time deployment progress
 """
 import asyncio
 import logging
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from typing import Dict, Any, Optional, List
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, Any, Optional, List, Set, Literal
+import orjson
 import uvicorn
 
 from .config import config
@@ -21,11 +24,20 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release the download/inference worker pools on shutdown
+    deployment_service.shutdown()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="PyTorch Model Deployment API",
     description="API for deploying and managing PyTorch models from HuggingFace Hub",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 app.include_router(router, prefix="/api")
@@ -43,67 +55,131 @@ app.add_middleware(
 
 # Pydantic models for request validation
 class ModelConfig(BaseModel):
+    # "model_" fields are ours, not pydantic's protected namespace
+    model_config = ConfigDict(extra="ignore", protected_namespaces=())
+    
     model_id: str
     model_source: str = "huggingface"
     
 class HardwareConfig(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     device: str = "auto"
     gpu_memory: Optional[int] = None
     cpu_threads: Optional[int] = None
 
 class DependencyConfig(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     packages: List[str] = []
     
 class DeploymentConfig(BaseModel):
+    model_config = ConfigDict(extra="ignore", protected_namespaces=())
+    
     model: ModelConfig
     hardware: HardwareConfig
     dependencies: DependencyConfig
     deployment_name: str
     model_type: str = "nlp"
+    quantization: Optional[Literal["int8", "nf4", "fp16", "bf16"]] = None
 
 
 class InferenceRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
     text: Optional[str] = None
     input: Optional[str] = None
     max_length: Optional[int] = 100
 
 
 # WebSocket connection manager
+def encode_message(message: dict) -> str:
+    """Serialize a WebSocket message once, ready to be sent to any subscriber"""
+    # Text frames, so browsers can still JSON.parse(event.data)
+    return orjson.dumps(message).decode()
+
+
+# Fixed frames, encoded once
+_HEARTBEAT_FRAME = encode_message({"type": "heartbeat"})
+_UNKNOWN_FRAME = encode_message({"status": "unknown"})
+
+
+class Subscriber:
+    """Outbound message queue for a single WebSocket client"""
+
+    def __init__(self, websocket: WebSocket, maxsize: int = config.WS_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: Optional[asyncio.Task] = None
+
+    def push(self, payload: str):
+        """Queue an encoded message, dropping the oldest one if the client lags behind"""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(payload)
+
+
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.active_connections: Dict[str, Set[Subscriber]] = {}
 
-    async def connect(self, websocket: WebSocket, deployment_id: str):
+    async def connect(self, websocket: WebSocket, deployment_id: str) -> Subscriber:
         await websocket.accept()
+        subscriber = Subscriber(websocket)
+        subscriber.task = asyncio.create_task(self._flush(subscriber, deployment_id))
         if deployment_id not in self.active_connections:
-            self.active_connections[deployment_id] = []
-        self.active_connections[deployment_id].append(websocket)
+            self.active_connections[deployment_id] = set()
+        self.active_connections[deployment_id].add(subscriber)
         logger.info(f"WebSocket connected for deployment: {deployment_id}")
-
-    def disconnect(self, websocket: WebSocket, deployment_id: str):
-        if deployment_id in self.active_connections:
-            self.active_connections[deployment_id].remove(websocket)
-            if not self.active_connections[deployment_id]:
-                del self.active_connections[deployment_id]
+        return subscriber
+
+    def disconnect(self, subscriber: Subscriber, deployment_id: str):
+        subscribers = self.active_connections.get(deployment_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        if not subscribers:
+            del self.active_connections[deployment_id]
+        if subscriber.task is not None:
+            subscriber.task.cancel()
         logger.info(f"WebSocket disconnected for deployment: {deployment_id}")
 
-    async def send_progress(self, deployment_id: str, message: dict):
-        if deployment_id in self.active_connections:
-            dead_connections = []
-            for connection in self.active_connections[deployment_id]:
-                try:
-                    await connection.send_json(message)
-                except Exception as e:
-                    logger.error(f"Error sending to WebSocket: {e}")
-                    dead_connections.append(connection)
-            
-            # Clean up dead connections
-            for dead in dead_connections:
-                self.disconnect(dead, deployment_id)
+    async def _flush(self, subscriber: Subscriber, deployment_id: str):
+        """Drain a subscriber's queue, merging queued-up messages into one frame"""
+        queue = subscriber.queue
+        try:
+            while True:
+                batch = [await queue.get()]
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+                if len(batch) == 1:
+                    payload = batch[0]
+                else:
+                    # Items are already JSON, splice them in rather than re-encoding
+                    payload = '{"type":"batch","items":[' + ','.join(batch) + ']}'
+                await subscriber.websocket.send_text(payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error sending to WebSocket: {e}")
+            self.disconnect(subscriber, deployment_id)
+
+    async def send_progress(self, deployment_id: str, payload: str):
+        # Enqueue only; each subscriber's flush task does the actual write,
+        # so a slow client never holds up the broadcast. The payload is
+        # encoded once by the caller and shared by every subscriber
+        for subscriber in self.active_connections.get(deployment_id, ()):
+            subscriber.push(payload)
 
 
 manager = ConnectionManager()
 
+_WS_BASE = f"ws://localhost:{config.BACKEND_PORT}{config.API_PREFIX}/ws"
+
+# The event loop only keeps weak references to tasks; hold in-flight
+# deployments here so they can't be garbage-collected mid-run
+_background_tasks: Set[asyncio.Task] = set()
+
 
 # API Routes
 @app.get("/")
@@ -116,12 +192,24 @@ async def root():
     }
 
 
+_iso_cache = {"ts": 0.0, "iso": ""}
+
+
+def _now_iso() -> str:
+    """Current time as an ISO string, re-formatted at most every 250ms"""
+    now = time.time()
+    if now - _iso_cache["ts"] > 0.25:
+        _iso_cache["ts"] = now
+        _iso_cache["iso"] = datetime.fromtimestamp(now).isoformat()
+    return _iso_cache["iso"]
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": _now_iso()
     }
 
 
@@ -140,25 +228,28 @@ async def deploy_model(deployment_config: DeploymentConfig):
         config_dict = {
             "model_id": deployment_config.model.model_id,
             "model_type": deployment_config.model_type,
+            "quantization": deployment_config.quantization,
             "deployment_name": deployment_id,
-            "hardware": deployment_config.hardware.dict(),
-            "dependencies": deployment_config.dependencies.dict()
+            "hardware": deployment_config.hardware.model_dump(),
+            "dependencies": deployment_config.dependencies.model_dump()
         }
         
         # Progress callback to send updates via WebSocket
-        async def progress_callback(progress_data: dict):
-            await manager.send_progress(deployment_id, progress_data)
+        async def progress_callback(progress_frame: str):
+            await manager.send_progress(deployment_id, progress_frame)
         
         # Start deployment in background
-        asyncio.create_task(
+        task = asyncio.create_task(
             deployment_service.deploy_model(config_dict, progress_callback)
         )
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
         
         return {
             "status": "started",
             "deployment_id": deployment_id,
             "message": "Deployment started. Connect to WebSocket for progress updates.",
-            "websocket_url": f"ws://localhost:{config.BACKEND_PORT}{config.API_PREFIX}/ws/{deployment_id}"
+            "websocket_url": f"{_WS_BASE}/{deployment_id}"
         }
         
     except Exception as e:
@@ -171,39 +262,39 @@ async def websocket_endpoint(websocket: WebSocket, deployment_id: str):
     """
     WebSocket endpoint for real-time deployment progress updates
     """
-    await manager.connect(websocket, deployment_id)
+    subscriber = await manager.connect(websocket, deployment_id)
     try:
         # Send initial status
-        status = deployment_service.get_deployment_status(deployment_id)
+        status = deployment_service.get_deployment_status_json(deployment_id)
         if status:
-            await websocket.send_json(status)
+            subscriber.push(status)
         
         # Keep connection alive and listen for heartbeat
         while True:
             try:
-                # Wait for heartbeat or timeout
-                data = await asyncio.wait_for(
-                    websocket.receive_text(),
+                # Wait for heartbeat or timeout. Read the raw ASGI message so
+                # "ping" is matched as sent (text or binary) without decoding
+                message = await asyncio.wait_for(
+                    websocket.receive(),
                     timeout=config.WS_HEARTBEAT_INTERVAL
                 )
+                if message["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(message.get("code", 1000))
                 
                 # If client sends "ping", respond with current status
-                if data == "ping":
-                    status = deployment_service.get_deployment_status(deployment_id)
-                    if status:
-                        await websocket.send_json(status)
-                    else:
-                        await websocket.send_json({"status": "unknown"})
+                if message.get("text") == "ping" or message.get("bytes") == b"ping":
+                    status = deployment_service.get_deployment_status_json(deployment_id)
+                    subscriber.push(status or _UNKNOWN_FRAME)
                         
             except asyncio.TimeoutError:
                 # Send heartbeat
-                await websocket.send_json({"type": "heartbeat"})
+                subscriber.push(_HEARTBEAT_FRAME)
                 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, deployment_id)
+        manager.disconnect(subscriber, deployment_id)
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        manager.disconnect(websocket, deployment_id)
+        manager.disconnect(subscriber, deployment_id)
 
 
 @app.get(f"{config.API_PREFIX}/deployments")
@@ -224,11 +315,11 @@ async def list_deployments():
 async def get_deployment(deployment_id: str):
     """Get detailed information about a specific deployment"""
     try:
-        if deployment_id not in deployment_service.deployed_models:
+        summary = deployment_service.get_deployment_summary(deployment_id)
+        if summary is None:
             raise HTTPException(status_code=404, detail="Deployment not found")
         
-        deployment_info = deployment_service.deployed_models[deployment_id]
-        return deployment_service._generate_deployment_summary(deployment_info)
+        return summary
         
     except HTTPException:
         raise
@@ -247,7 +338,7 @@ async def run_inference(deployment_id: str, request: InferenceRequest):
     }
     """
     try:
-        input_data = request.dict(exclude_none=True)
+        input_data = request.model_dump(exclude_none=True)
         result = await deployment_service.inference(deployment_id, input_data)
         return result
         
@@ -266,9 +357,7 @@ async def delete_deployment(deployment_id: str):
         if deployment_id not in deployment_service.deployed_models:
             raise HTTPException(status_code=404, detail="Deployment not found")
         
-        del deployment_service.deployed_models[deployment_id]
-        if deployment_id in deployment_service.deployments:
-            del deployment_service.deployments[deployment_id]
+        deployment_service.remove_deployment(deployment_id)
         
         return {
             "status": "success",
@@ -295,6 +384,12 @@ def main():
         host=config.BACKEND_HOST,
         port=config.BACKEND_PORT,
         reload=False,
+        # Deployed models and progress state live in this process's memory
+        # and can't be shared, so run exactly one worker
+        workers=1,
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
         log_level=config.LOG_LEVEL.lower()
     )
 
@@ -36,18 +36,28 @@ class Config:
     MAX_DOWNLOAD_TIMEOUT: int = int(os.getenv('MAX_DOWNLOAD_TIMEOUT', '1800'))
     MODEL_INFERENCE_TIMEOUT: int = int(os.getenv('MODEL_INFERENCE_TIMEOUT', '120'))
     MAX_WORKERS: int = int(os.getenv('MAX_WORKERS', '4'))
+    INFERENCE_MAX_BATCH: int = int(os.getenv('INFERENCE_MAX_BATCH', '8'))
+    INFERENCE_BATCH_WINDOW_MS: int = int(os.getenv('INFERENCE_BATCH_WINDOW_MS', '10'))
+    # Opt-in torch.compile of deployed models on CUDA (MODEL_COMPILE=true);
+    # the first load of each model then pays a multi-minute compile
+    MODEL_COMPILE: bool = os.getenv('MODEL_COMPILE', 'false').lower() == 'true'
     
     # WebSocket Configuration
     WS_HEARTBEAT_INTERVAL: int = int(os.getenv('WS_HEARTBEAT_INTERVAL', '30'))
     WS_CONNECTION_TIMEOUT: int = int(os.getenv('WS_CONNECTION_TIMEOUT', '3600'))
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv('WS_SEND_QUEUE_SIZE', '32'))
     
     # Model Serving Configuration
     MODEL_SERVE_PORT_START: int = int(os.getenv('MODEL_SERVE_PORT_START', '8100'))
     MODEL_SERVE_PORT_END: int = int(os.getenv('MODEL_SERVE_PORT_END', '8200'))
+    # Let the OS pick any free port instead of scanning the range above
+    MODEL_SERVE_PORT_EPHEMERAL: bool = os.getenv('MODEL_SERVE_PORT_EPHEMERAL', 'false').lower() == 'true'
     
     # Resource Limits
     MAX_MODEL_SIZE_GB: int = int(os.getenv('MAX_MODEL_SIZE_GB', '10'))
     MAX_MEMORY_PER_MODEL_GB: int = int(os.getenv('MAX_MEMORY_PER_MODEL_GB', '8'))
+    # Models kept loaded by the /test-model endpoints (least recently used evicted)
+    MODEL_CACHE_SIZE: int = int(os.getenv('MODEL_CACHE_SIZE', '2'))
     
     # Logging
     LOG_LEVEL: str = os.getenv('LOG_LEVEL', 'INFO')
@@ -73,10 +83,23 @@ class Config:
     def get_available_port(cls) -> int:
         """Get next available port for model serving"""
         import socket
+        if cls.MODEL_SERVE_PORT_EPHEMERAL:
+            # One bind to port 0: the kernel hands back a free port
+            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                s.bind(('', 0))
+                return s.getsockname()[1]
+        
         for port in range(cls.MODEL_SERVE_PORT_START, cls.MODEL_SERVE_PORT_END):
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                if s.connect_ex(('localhost', port)) != 0:
-                    return port
+                # Probe with bind() rather than connect_ex(): a single local
+                # syscall, no loopback handshake, and SO_REUSEADDR keeps ports
+                # lingering in TIME_WAIT from being reported as taken
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                try:
+                    s.bind(('', port))
+                except OSError:
+                    continue
+                return port
         raise RuntimeError("No available ports for model serving")
 
 
@@ -2,14 +2,30 @@
 Model Deployment Service with progress tracking and timeout handling
 """
 import asyncio
+import functools
+import importlib.util
 import json
 import logging
+import operator
+import orjson
 import shutil
+import threading
 import time
+import os
+from collections import OrderedDict
+
+# Rust-backed parallel shard downloads when the optional hf_transfer
+# extension is installed. huggingface_hub reads this at import time
+if importlib.util.find_spec("hf_transfer") is not None:
+    os.environ.setdefault("HF_HUB_ENABLE_HF_TRANSFER", "1")
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, Optional, Callable, List, Annotated
 from datetime import datetime
 import torch
+from huggingface_hub import snapshot_download
+from tqdm.auto import tqdm
 from transformers import (
     AutoTokenizer, 
     AutoModel, 
@@ -17,12 +33,13 @@ from transformers import (
     AutoModelForCausalLM,
     AutoModelForSeq2SeqLM,
     AutoProcessor,
+    BitsAndBytesConfig,
     pipeline
 )
 from .config import config
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-import os
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 from dotenv import load_dotenv
 
 
@@ -30,6 +47,122 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()  # Load .env file
 
+# Fixed for the life of the process, so probe/format them once at import
+_CUDA_AVAILABLE = torch.cuda.is_available()
+_API_BASE = f"http://localhost:{config.BACKEND_PORT}/api/v1/deployments"
+_TEST_UI_BASE = f"http://localhost:{config.FRONTEND_PORT}/test"
+_CACHE_DIR = str(config.HUGGINGFACE_CACHE_DIR)
+
+# Model type -> Auto class to load. Text models are served through the
+# text-generation pipeline, so load them with their LM head up front
+_MODEL_CLS = {
+    "nlp": AutoModelForCausalLM,
+    "text": AutoModelForCausalLM,
+    "causal-lm": AutoModelForCausalLM,
+    "seq2seq": AutoModelForSeq2SeqLM,
+    "cls": AutoModelForSequenceClassification,
+    "embedding": AutoModel,
+}
+
+# Fields exposed by list_deployments, fetched in one itemgetter call
+_LIST_FIELDS = ("deployment_id", "model_id", "status", "endpoint_url", "created_at")
+_LIST_GET = operator.itemgetter(*_LIST_FIELDS)
+
+# Usage examples included in deployment summaries
+_CURL_TMPL = """
+curl -X POST {endpoint} \\
+  -H "Content-Type: application/json" \\
+  -d '{body}'
+"""
+_PY_TMPL = """
+import requests
+
+response = requests.post(
+    '{endpoint}',
+    json={body}
+)
+print(response.json())
+"""
+_EXAMPLE_BODY_NLP = '{"text": "Hello, how are you?"}'
+_EXAMPLE_BODY_DEFAULT = '{"input": "your input data"}'
+
+# Weights for other frameworks (and Meta's original checkpoints) that
+# from_pretrained never reads
+_SNAPSHOT_IGNORE = [
+    "*.h5", "*.msgpack", "*.ot", "*.tflite", "*.onnx", "*.mlmodel",
+    "onnx/*", "coreml/*", "original/*", "tf_model*", "flax_model*", "rust_model*",
+]
+# Pickled PyTorch weights, redundant when the repo also ships safetensors
+_PICKLED_WEIGHTS = ["*.bin", "*.pt", "*.pth"]
+
+
+def _fetch_snapshot(model_id: str, tqdm_class) -> str:
+    """
+    Download the files from_pretrained needs into the HF cache (blocking).
+    Like from_pretrained, only one weight format is fetched: safetensors
+    when the repo has them, the pickled weights otherwise. A local model
+    directory is used as is
+    """
+    if os.path.isdir(model_id):
+        return model_id
+    download = functools.partial(
+        snapshot_download,
+        repo_id=model_id,
+        cache_dir=_CACHE_DIR,
+        max_workers=8,
+        tqdm_class=tqdm_class,
+        #token=config.HUGGINGFACE_TOKEN
+    )
+    local_path = download(ignore_patterns=_SNAPSHOT_IGNORE + _PICKLED_WEIGHTS)
+    if not any(Path(local_path).rglob("*.safetensors")):
+        # No safetensors in the repo: fetch the pickled weights after all
+        # (the files already downloaded are reused from the cache)
+        local_path = download(ignore_patterns=_SNAPSHOT_IGNORE)
+    return local_path
+
+
+def _progress_tqdm(on_update: Callable[[int, int], None]):
+    """tqdm class that forwards snapshot_download's files-done/total to a callback"""
+    class _ProgressTqdm(tqdm):
+        def update(self, n=1):
+            displayed = super().update(n)
+            if self.total:
+                on_update(self.n, self.total)
+            return displayed
+    return _ProgressTqdm
+
+def _pick_dtype() -> torch.dtype:
+    """Pick the narrowest floating point dtype the hardware runs natively"""
+    if _CUDA_AVAILABLE:
+        return torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+    cpu_bf16_supported = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    if cpu_bf16_supported is not None and cpu_bf16_supported():
+        return torch.bfloat16
+    return torch.float32
+
+
+def _precision_kwargs(quantization: Optional[str] = None) -> Dict[str, Any]:
+    """from_pretrained kwargs for the requested precision/quantization"""
+    if quantization in ('int8', 'nf4'):
+        # bitsandbytes kernels are CUDA only
+        if not _CUDA_AVAILABLE:
+            raise ValueError(f"{quantization} quantization requires a CUDA GPU")
+        if quantization == 'int8':
+            quantization_config = BitsAndBytesConfig(load_in_8bit=True)
+        else:
+            quantization_config = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16
+            )
+        return {"quantization_config": quantization_config}
+    if quantization == 'fp16':
+        return {"torch_dtype": torch.float16}
+    if quantization == 'bf16':
+        return {"torch_dtype": torch.bfloat16}
+    return {"torch_dtype": _pick_dtype()}
+
+
 class DeploymentProgress:
     """Track deployment progress"""
     def __init__(self, deployment_id: str):
@@ -42,6 +175,8 @@ class DeploymentProgress:
         self.completed_steps = 0
         self.start_time = time.time()
         self.errors = []
+        # Encoded frame for the current state, rebuilt only after update()
+        self._encoded: Optional[str] = None
         
     def update(self, status: str = None, progress: int = None, 
                message: str = None, current_step: str = None):
@@ -55,6 +190,7 @@ class DeploymentProgress:
         if current_step:
             self.current_step = current_step
             self.completed_steps += 1
+        self._encoded = None
             
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
@@ -69,6 +205,12 @@ class DeploymentProgress:
             "elapsed_time": time.time() - self.start_time,
             "errors": self.errors
         }
+    
+    def to_json(self) -> str:
+        """JSON-encoded progress frame, memoized until the next update()"""
+        if self._encoded is None:
+            self._encoded = orjson.dumps(self.to_dict()).decode()
+        return self._encoded
 
 
 class ModelDeploymentService:
@@ -77,6 +219,19 @@ class ModelDeploymentService:
     def __init__(self):
         self.deployments: Dict[str, DeploymentProgress] = {}
         self.deployed_models: Dict[str, Any] = {}
+        # Responses that don't change once a deployment is running
+        self._summary_cache: Dict[str, Dict[str, Any]] = {}
+        self._list_cache: Optional[List[Dict[str, Any]]] = None
+        # Dedicated pool for HuggingFace downloads so long fetches don't
+        # tie up the default executor
+        self._download_pool = ThreadPoolExecutor(
+            max_workers=config.MAX_WORKERS, thread_name_prefix="hf-dl"
+        )
+        # Small, separate pool for model execution: bounds how many threads
+        # contend for the model at once and keeps downloads from starving it
+        self._inference_pool = ThreadPoolExecutor(
+            max_workers=config.MAX_WORKERS, thread_name_prefix="infer"
+        )
         
     async def deploy_model(
         self, 
@@ -93,7 +248,8 @@ class ModelDeploymentService:
                 - deployment_name: Name for the deployment
                 - hardware: Hardware configuration
                 - dependencies: Additional dependencies
-            progress_callback: Async callback function for progress updates
+            progress_callback: Async callback receiving each progress update
+                as an already JSON-encoded frame
             
         Returns:
             Deployment information including endpoint URL and usage instructions
@@ -111,7 +267,6 @@ class ModelDeploymentService:
                 message="Validating deployment configuration...",
                 current_step="Configuration validation"
             )
-            await asyncio.sleep(0.5)
             
             model_id = deployment_config.get('model_id')
             if not model_id:
@@ -130,7 +285,8 @@ class ModelDeploymentService:
                 model_id, 
                 deployment_config.get('model_type', 'nlp'),
                 progress,
-                progress_callback
+                progress_callback,
+                quantization=deployment_config.get('quantization')
             )
             
             # Step 3: Load model into memory
@@ -141,7 +297,6 @@ class ModelDeploymentService:
                 message="Loading model into memory...",
                 current_step="Model loading"
             )
-            await asyncio.sleep(0.5)
             
             # Step 4: Create inference pipeline
             await self._update_progress(
@@ -166,6 +321,16 @@ class ModelDeploymentService:
                 current_step="Server startup"
             )
             
+            # Pay for kernel loading/autotuning and torch.compile tracing
+            # now rather than on the first user request
+            if tokenizer is not None:
+                try:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self._inference_pool, self._warmup, model, tokenizer
+                    )
+                except Exception as e:
+                    logger.warning(f"Warmup failed for {deployment_id}: {e}")
+            
             port = config.get_available_port()
             endpoint_url = f"http://{config.BACKEND_HOST}:{port}/predict"
             
@@ -180,12 +345,14 @@ class ModelDeploymentService:
                 "created_at": datetime.now().isoformat(),
                 "pipeline": inference_pipeline,
                 "model": model,
+                "precision": deployment_config.get('quantization') or str(model.dtype).replace("torch.", ""),
                 "tokenizer": tokenizer,
                 "processor": processor,
                 "config": deployment_config
             }
-            
             self.deployed_models[deployment_id] = deployment_info
+            self._summary_cache[deployment_id] = self._generate_deployment_summary(deployment_info)
+            self._list_cache = None
             
             # Step 6: Complete deployment
             await self._update_progress(
@@ -196,7 +363,7 @@ class ModelDeploymentService:
                 current_step="Deployment complete"
             )
             
-            return self._generate_deployment_summary(deployment_info)
+            return self._summary_cache[deployment_id]
             
         except Exception as e:
             logger.error(f"Deployment failed: {str(e)}", exc_info=True)
@@ -215,63 +382,72 @@ class ModelDeploymentService:
         model_id: str, 
         model_type: str,
         progress: DeploymentProgress,
-        progress_callback: Optional[Callable] = None
+        progress_callback: Optional[Callable] = None,
+        quantization: Optional[str] = None
     ):
         """Download model from HuggingFace Hub with progress tracking"""
         try:
-            # Update progress during download
-            for i in range(20, 55, 5):
-                await self._update_progress(
-                    progress, progress_callback,
-                    progress=i,
-                    message=f"Downloading model components... ({i}%)"
-                )
-                await asyncio.sleep(0.5)
-            
-            # Actual download with timeout protection
-            loop = asyncio.get_event_loop()
+            loop = asyncio.get_running_loop()
             
-            # Download tokenizer/processor
-            if model_type in ['nlp', 'text']:
-                tokenizer = await asyncio.wait_for(
-                    loop.run_in_executor(
-                        None,
-                        lambda: AutoTokenizer.from_pretrained(
-                            model_id,
-                            cache_dir=str(config.HUGGINGFACE_CACHE_DIR),
-                            #token=config.HUGGINGFACE_TOKEN
-                        )
+            def on_files(done: int, total: int):
+                # Called from the download thread; hop back onto the loop
+                asyncio.run_coroutine_threadsafe(
+                    self._update_progress(
+                        progress, progress_callback,
+                        progress=20 + 30 * done // total,
+                        message=f"Downloaded {done}/{total} files of '{model_id}'"
                     ),
-                    timeout=config.MAX_DOWNLOAD_TIMEOUT
-                )
-                processor = None
-            else:
-                tokenizer = None
-                processor = await asyncio.wait_for(
-                    loop.run_in_executor(
-                        None,
-                        lambda: AutoProcessor.from_pretrained(
-                            model_id,
-                            cache_dir=str(config.HUGGINGFACE_CACHE_DIR),
-                            #token=config.HUGGINGFACE_TOKEN if config.HUGGINGFACE_TOKEN else None,
-                        )
-                    ),
-                    timeout=config.MAX_DOWNLOAD_TIMEOUT
+                    loop
                 )
             
-            # Download model
-            model = await asyncio.wait_for(
-                loop.run_in_executor(
-                    None,
-                    lambda: AutoModel.from_pretrained(
-                        model_id,
-                        cache_dir=str(config.HUGGINGFACE_CACHE_DIR),
-                        #token=config.HUGGINGFACE_TOKEN,
-                        torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
+            async def fetch_and_load():
+                # Fetch the repo once, reporting real per-file progress
+                local_path = await loop.run_in_executor(
+                    self._download_pool,
+                    _fetch_snapshot, model_id, _progress_tqdm(on_files)
+                )
+                
+                # Load from the local snapshot, no further network round-trips.
+                # The tokenizer/processor and the weights are independent, so
+                # load them concurrently
+                preprocessor_cls = AutoTokenizer if model_type in ['nlp', 'text'] else AutoProcessor
+                preprocessor_future = loop.run_in_executor(
+                    self._download_pool,
+                    functools.partial(preprocessor_cls.from_pretrained, local_path, local_files_only=True)
+                )
+                
+                model_cls = _MODEL_CLS.get(model_type, AutoModel)
+                model_future = loop.run_in_executor(
+                    self._download_pool,
+                    functools.partial(
+                        model_cls.from_pretrained,
+                        local_path,
+                        local_files_only=True,
+                        # Stream weights straight onto the target device instead of
+                        # materializing a full copy on the host first
+                        low_cpu_mem_usage=True,
+                        device_map="auto",
+                        **_precision_kwargs(quantization)
                     )
-                ),
+                )
+                return await asyncio.gather(preprocessor_future, model_future)
+            
+            # Actual download with timeout protection
+            preprocessor, model = await asyncio.wait_for(
+                fetch_and_load(),
                 timeout=config.MAX_DOWNLOAD_TIMEOUT
             )
+            if model_type in ['nlp', 'text']:
+                tokenizer, processor = preprocessor, None
+            else:
+                tokenizer, processor = None, preprocessor
+            
+            # Compile the forward pass for fused kernels and CUDA graphs.
+            # Patching forward (rather than wrapping the module) keeps
+            # generate() and the pipeline working on the original class.
+            # bitsandbytes layers don't trace, so quantized models stay eager
+            if config.MODEL_COMPILE and _CUDA_AVAILABLE and quantization not in ('int8', 'nf4'):
+                model.forward = torch.compile(model.forward, mode="reduce-overhead", fullgraph=False)
             
             await self._update_progress(
                 progress, progress_callback,
@@ -293,11 +469,23 @@ class ModelDeploymentService:
         """Create inference pipeline based on model type"""
         try:
             if model_type in ['nlp', 'text']:
+                # Batched generation pads inputs to a common length. Causal
+                # LMs continue from the last position, so pad on the left
+                if tokenizer.pad_token is None:
+                    tokenizer.pad_token = tokenizer.eos_token
+                tokenizer.padding_side = 'left'
+                
+                # Models placed by device_map are already on their device and
+                # the pipeline refuses to move them again
+                if getattr(model, "hf_device_map", None):
+                    device = None
+                else:
+                    device = 0 if _CUDA_AVAILABLE else -1
                 return pipeline(
                     "text-generation",
                     model=model,
                     tokenizer=tokenizer,
-                    device=0 if torch.cuda.is_available() else -1
+                    device=device
                 )
             else:
                 # For other model types, return a basic wrapper
@@ -314,6 +502,13 @@ class ModelDeploymentService:
                 "processor": processor
             }
     
+    def _warmup(self, model, tokenizer, passes: int = 2):
+        """Run a few dummy forward passes on a freshly loaded model (blocking)"""
+        inputs = tokenizer("warmup", return_tensors="pt").to(model.device)
+        with torch.inference_mode():
+            for _ in range(passes):
+                model(**inputs)
+    
     async def _update_progress(
         self, 
         prog_tracker: DeploymentProgress,
@@ -323,7 +518,7 @@ class ModelDeploymentService:
         """Update progress and call callback if provided"""
         prog_tracker.update(**kwargs)
         if callback:
-            await callback(prog_tracker.to_dict())
+            await callback(prog_tracker.to_json())
     
     def _generate_deployment_summary(self, deployment_info: Dict[str, Any]) -> Dict[str, Any]:
         """Generate comprehensive deployment summary"""
@@ -331,39 +526,12 @@ class ModelDeploymentService:
         deployment_id = deployment_info['deployment_id']
         
         # Generate correct API endpoint URL
-        api_endpoint = f"http://localhost:{config.BACKEND_PORT}/api/v1/deployments/{deployment_id}/inference"
+        api_endpoint = f"{_API_BASE}/{deployment_id}/inference"
         
         # Generate example usage based on model type
-        if model_type == 'nlp':
-            example_curl = f"""
-curl -X POST {api_endpoint} \\
-  -H "Content-Type: application/json" \\
-  -d '{{"text": "Hello, how are you?"}}'
-"""
-            example_python = f"""
-import requests
-
-response = requests.post(
-    '{api_endpoint}',
-    json={{"text": "Hello, how are you?"}}
-)
-print(response.json())
-"""
-        else:
-            example_curl = f"""
-curl -X POST {api_endpoint} \\
-  -H "Content-Type: application/json" \\
-  -d '{{"input": "your input data"}}'
-"""
-            example_python = f"""
-import requests
-
-response = requests.post(
-    '{api_endpoint}',
-    json={{"input": "your input data"}}
-)
-print(response.json())
-"""
+        body = _EXAMPLE_BODY_NLP if model_type == 'nlp' else _EXAMPLE_BODY_DEFAULT
+        example_curl = _CURL_TMPL.format(endpoint=api_endpoint, body=body)
+        example_python = _PY_TMPL.format(endpoint=api_endpoint, body=body)
         
         return {
             "deployment_id": deployment_info['deployment_id'],
@@ -380,13 +548,14 @@ print(response.json())
                 "content_type": "application/json",
                 "example_curl": example_curl,
                 "example_python": example_python,
-                "test_ui_url": f"http://localhost:{config.FRONTEND_PORT}/test/{deployment_info['deployment_id']}"
+                "test_ui_url": f"{_TEST_UI_BASE}/{deployment_id}"
             },
             "model_info": {
                 "source": f"HuggingFace Hub: {deployment_info['model_id']}",
                 "type": deployment_info['model_type'],
-                "device": "CUDA" if torch.cuda.is_available() else "CPU",
-                "cache_location": str(config.HUGGINGFACE_CACHE_DIR)
+                "device": "CUDA" if _CUDA_AVAILABLE else "CPU",
+                "precision": deployment_info['precision'],
+                "cache_location": _CACHE_DIR
             }
         }
     
@@ -396,18 +565,43 @@ print(response.json())
             return self.deployments[deployment_id].to_dict()
         return None
     
+    def get_deployment_status_json(self, deployment_id: str) -> Optional[str]:
+        """Get current deployment status as an already-encoded JSON frame"""
+        progress = self.deployments.get(deployment_id)
+        return progress.to_json() if progress is not None else None
+    
+    def get_deployment_summary(self, deployment_id: str) -> Optional[Dict[str, Any]]:
+        """Get the (cached) deployment summary"""
+        return self._summary_cache.get(deployment_id)
+    
+    def remove_deployment(self, deployment_id: str):
+        """Forget a deployment and drop its cached responses"""
+        deployment = self.deployed_models.pop(deployment_id, None)
+        if deployment is not None and deployment.get('batch_task') is not None:
+            deployment['batch_task'].cancel()
+            # Fail queued requests now rather than letting them hit the timeout
+            self._fail_pending(deployment['batch_queue'])
+        self.deployments.pop(deployment_id, None)
+        self._summary_cache.pop(deployment_id, None)
+        self._list_cache = None
+    
+    def shutdown(self):
+        """Stop batch workers and release the worker pools"""
+        for deployment in self.deployed_models.values():
+            if deployment.get('batch_task') is not None:
+                deployment['batch_task'].cancel()
+        self._download_pool.shutdown(wait=False, cancel_futures=True)
+        self._inference_pool.shutdown(wait=False, cancel_futures=True)
+    
     def list_deployments(self) -> list:
         """List all active deployments"""
-        return [
-            {
-                "deployment_id": dep_id,
-                "model_id": info['model_id'],
-                "status": info['status'],
-                "endpoint_url": info['endpoint_url'],
-                "created_at": info['created_at']
-            }
-            for dep_id, info in self.deployed_models.items()
-        ]
+        # Rebuilt only after a deployment is added or removed
+        if self._list_cache is None:
+            self._list_cache = [
+                dict(zip(_LIST_FIELDS, _LIST_GET(info)))
+                for info in self.deployed_models.values()
+            ]
+        return self._list_cache
     
     async def inference(self, deployment_id: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
         """Run inference on a deployed model"""
@@ -415,18 +609,22 @@ print(response.json())
             raise ValueError(f"Deployment {deployment_id} not found")
         
         deployment = self.deployed_models[deployment_id]
-        pipeline_obj = deployment['pipeline']
+        
+        # Requests are queued and served in micro-batches by one worker
+        # task per deployment, started on first use
+        if deployment.get('batch_task') is None:
+            deployment['batch_queue'] = asyncio.Queue()
+            deployment['batch_task'] = asyncio.create_task(
+                self._batch_worker(deployment['pipeline'], deployment['batch_queue'])
+            )
+        
+        text = input_data.get('text', input_data.get('input', ''))
+        future = asyncio.get_running_loop().create_future()
+        deployment['batch_queue'].put_nowait((text, future))
         
         try:
             # Run inference with timeout
-            loop = asyncio.get_event_loop()
-            result = await asyncio.wait_for(
-                loop.run_in_executor(
-                    None,
-                    lambda: self._run_inference(pipeline_obj, input_data)
-                ),
-                timeout=config.MODEL_INFERENCE_TIMEOUT
-            )
+            result = await asyncio.wait_for(future, timeout=config.MODEL_INFERENCE_TIMEOUT)
             
             return {
                 "status": "success",
@@ -440,16 +638,63 @@ print(response.json())
         except Exception as e:
             raise RuntimeError(f"Inference failed: {str(e)}")
     
-    def _run_inference(self, pipeline_obj, input_data: Dict[str, Any]):
-        """Actually run the inference (blocking)"""
+    async def _batch_worker(self, pipeline_obj, queue: asyncio.Queue):
+        """Collect requests arriving within the batch window and run them together"""
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await queue.get()]
+                deadline = loop.time() + config.INFERENCE_BATCH_WINDOW_MS / 1000
+                while len(batch) < config.INFERENCE_MAX_BATCH:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        break
+                
+                texts = [text for text, _ in batch]
+                try:
+                    results = await loop.run_in_executor(
+                        self._inference_pool, self._run_inference, pipeline_obj, texts
+                    )
+                except Exception as e:
+                    for _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                
+                # Requests that timed out already have a cancelled future
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        except asyncio.CancelledError:
+            # Deployment was removed: fail the in-flight batch and the queue
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Deployment was removed"))
+            self._fail_pending(queue)
+            raise
+    
+    @staticmethod
+    def _fail_pending(queue: asyncio.Queue):
+        """Fail every request still waiting in a deployment's batch queue"""
+        while not queue.empty():
+            _, future = queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Deployment was removed"))
+    
+    def _run_inference(self, pipeline_obj, texts: List[str]) -> list:
+        """Actually run the inference on a batch of inputs (blocking)"""
         if isinstance(pipeline_obj, dict):
             # Basic wrapper - implement custom inference
-            text = input_data.get('text', input_data.get('input', ''))
-            return {"output": f"Processed: {text}"}
+            return [{"output": f"Processed: {text}"} for text in texts]
         else:
-            # Use HuggingFace pipeline
-            text = input_data.get('text', input_data.get('input', ''))
-            return pipeline_obj(text, max_length=100)
+            # Use HuggingFace pipeline; without batch_size it would still
+            # run the inputs one at a time
+            return pipeline_obj(texts, max_length=100, batch_size=len(texts))
 
 
 ######## Model Testing Code ####
@@ -458,36 +703,128 @@ print(response.json())
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
+
+# model_name -> resolved HuggingFace snapshot directory
+_SNAPSHOT_PATH_CACHE: Dict[str, str] = {}
+
+
+def _resolve_snapshot_path(model_name: str) -> Optional[str]:
+    """Find the local snapshot directory for a model, or None if not downloaded"""
+    cache_dir = os.getenv("HUGGINGFACE_CACHE_DIR", "./huggingface_cache")
+    model_path = f"{cache_dir}/models--{model_name.replace('/', '--')}/snapshots"
+
+    # HuggingFace stores models in a specific structure
+    # Get the latest snapshot
+    if os.path.exists(model_path):
+        snapshots = os.listdir(model_path)
+        if snapshots:
+            model_path = os.path.join(model_path, snapshots[0])
+            _SNAPSHOT_PATH_CACHE[model_name] = model_path
+    
+    if not os.path.exists(model_path):
+        return None
+    return model_path
+
+
+class LRUModelCache(OrderedDict):
+    """Loaded models keyed by name, bounded to the most recently used ones"""
+
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = max(1, maxsize)
+        # Loads and lookups run in to_thread workers, so guard with a thread lock
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return a cached entry and mark it most recently used"""
+        with self._lock:
+            if key not in self:
+                return default
+            self.move_to_end(key)
+            return self[key]
+
+    def put(self, key: str, entry):
+        """Insert a loaded entry, evicting least recently used ones past maxsize"""
+        evicted = []
+        with self._lock:
+            self[key] = entry
+            self.move_to_end(key)
+            while len(self) > self.maxsize:
+                name, _ = self.popitem(last=False)
+                evicted.append(name)
+        if evicted:
+            logger.info(f"Evicting cached models: {evicted}")
+            if _CUDA_AVAILABLE:
+                torch.cuda.empty_cache()
+        return entry
+
+    def evict(self, key: str) -> bool:
+        """Drop an entry and free its memory; False if it wasn't cached"""
+        with self._lock:
+            if key not in self:
+                return False
+            del self[key]
+        if _CUDA_AVAILABLE:
+            torch.cuda.empty_cache()
+        return True
+
 
 # Cache for loaded models to avoid reloading on each request
-model_cache = {}
+model_cache = LRUModelCache(config.MODEL_CACHE_SIZE)
+# One lock per model name so concurrent requests for the same uncached
+# model wait for a single load instead of each loading the weights
+_loading_locks: Dict[str, threading.Lock] = {}
+
+
+def _loading_lock(model_name: str) -> threading.Lock:
+    # dict.setdefault is atomic, so racing threads get the same lock
+    return _loading_locks.setdefault(model_name, threading.Lock())
 
 class TestModelRequest(BaseModel):
+    # "model_" fields are ours, not pydantic's protected namespace
+    model_config = ConfigDict(extra="ignore", frozen=True, protected_namespaces=())
+    
     model_name: str
-    input_text: str
+    # Reject oversized prompts at parse time
+    input_text: Annotated[str, Field(max_length=10_000)]
     max_length: Optional[int] = 100
     temperature: Optional[float] = 0.7
 
 class TestModelResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True, protected_namespaces=())
+    
     output: str
     model_name: str
     status: str
 
-def load_model(model_name: str, model_path: str):
+def load_model(model_name: str, model_path: str, quantization: Optional[str] = None):
     """
     Load a Hugging Face model and tokenizer
     Args:
         model_name: Name of the model (e.g., 'openai-community/gpt2-large')
         model_path: Local path where model is stored
+        quantization: Optional int8/nf4/fp16/bf16 override (see _precision_kwargs)
     """
     cache_key = model_name
     
     # Return cached model if already loaded
-    if cache_key in model_cache:
+    model_dict = model_cache.get(cache_key)
+    if model_dict is not None:
         logger.info(f"Using cached model: {model_name}")
-        return model_cache[cache_key]
+        return model_dict
     
+    with _loading_lock(cache_key):
+        # Another request may have loaded it while we waited
+        model_dict = model_cache.get(cache_key)
+        if model_dict is not None:
+            return model_dict
+        return _load_uncached(model_name, model_path, quantization)
+
+
+def _load_uncached(model_name: str, model_path: str, quantization: Optional[str]):
+    """Load a model that isn't cached yet (caller holds its loading lock)"""
+    cache_key = model_name
     try:
         logger.info(f"Loading model from: {model_path}")
         
@@ -496,47 +833,51 @@ def load_model(model_name: str, model_path: str):
             raise FileNotFoundError(f"Model path does not exist: {model_path}")
         
         # Load tokenizer and model
-        tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True)
+        # Rust-backed fast tokenizer; some repos otherwise fall back to the
+        # pure-Python one
+        tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True, use_fast=True)
         
-        # Set pad token if not exists
+        # Set pad token once, before the tokenizer is cached
         if tokenizer.pad_token is None:
             tokenizer.pad_token = tokenizer.eos_token
         
         # Determine device
         # device = "cuda" if torch.cuda.is_available() else "cpu"
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        device = torch.device("cuda" if _CUDA_AVAILABLE else "cpu")
         logger.info(f"Using device: {device}")
         
         # Load model
+        # With low_cpu_mem_usage + device_map, transformers builds the model
+        # on the meta device and loads (mmap'd) shards straight onto the
+        # target device, so there is no host copy to move afterwards
         model = AutoModelForCausalLM.from_pretrained(
         model_path,
         local_files_only=True,
-        torch_dtype=torch.float16 if device.type == "cuda" else torch.float32,
-        low_cpu_mem_usage=True  # Add this
+        low_cpu_mem_usage=True,
+        **_precision_kwargs(quantization),
+        device_map={"": str(device)}
         )
-        model = model.to(device)
+        # Evaluation mode and frozen weights, set once before caching
         model.eval()
+        model.requires_grad_(False)
         
-        if device == "cpu":
-            model = model.to(device)
-        
-        model.eval()  # Set to evaluation mode
-        
-        # Cache the model and tokenizer
-        model_cache[cache_key] = {
+        # Cache the model and tokenizer. Older entries are only evicted
+        # now, so a load that fails never pushes a working model out
+        model_dict = model_cache.put(cache_key, {
             'model': model,
             'tokenizer': tokenizer,
             'device': device
-        }
+        })
         
         logger.info(f"Successfully loaded model: {model_name}")
-        return model_cache[cache_key]
+        return model_dict
         
     except Exception as e:
         logger.error(f"Error loading model {model_name}: {str(e)}")
         raise
 
 
+@torch.inference_mode()
 def generate_text(model_dict, input_text: str, max_length: int = 100, temperature: float = 0.7):
     """
     Generate text using the loaded model
@@ -548,20 +889,25 @@ def generate_text(model_dict, input_text: str, max_length: int = 100, temperatur
         
         # FIXED - Ensure everything is on the same device
         inputs = tokenizer(input_text, return_tensors="pt", padding=True)
-        inputs = {k: v.to(device) for k, v in inputs.items()}
+        if device.type == "cuda":
+            # Pinned host memory lets the copy run async and overlap with generate()
+            inputs = {k: v.pin_memory().to(device, non_blocking=True) for k, v in inputs.items()}
+        else:
+            inputs = {k: v.to(device) for k, v in inputs.items()}
 
         # Generate output
-        with torch.no_grad():
-            output_ids = model.generate(
-                input_ids=inputs['input_ids'],  # Explicitly pass input_ids
-                attention_mask=inputs['attention_mask'],  # Explicitly pass attention_mask
-                max_length=max_length,
-                temperature=temperature,
-                do_sample=True,
-                top_p=0.9,
-                pad_token_id=tokenizer.pad_token_id,
-                eos_token_id=tokenizer.eos_token_id
-            )
+        output_ids = model.generate(
+            input_ids=inputs['input_ids'],  # Explicitly pass input_ids
+            attention_mask=inputs['attention_mask'],  # Explicitly pass attention_mask
+            # Budget new tokens, independent of the prompt length
+            max_new_tokens=max_length,
+            use_cache=True,
+            temperature=temperature,
+            do_sample=True,
+            top_p=0.9,
+            pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id
+        )
         
         # Decode output
         generated_text = tokenizer.decode(output_ids[0], skip_special_tokens=True)
@@ -585,28 +931,23 @@ async def test_model(request: TestModelRequest):
         # Adjust this path based on your deployment structure
 
 
-        model_name_safe = request.model_name.replace("/", "_")
-        cache_dir = os.getenv("HUGGINGFACE_CACHE_DIR", "./huggingface_cache")
-        model_path = f"{cache_dir}/models--{request.model_name.replace('/', '--')}/snapshots"
-
-        # HuggingFace stores models in a specific structure
-        # Get the latest snapshot
-        if os.path.exists(model_path):
-            snapshots = os.listdir(model_path)
-            if snapshots:
-                model_path = os.path.join(model_path, snapshots[0])
+        model_path = _SNAPSHOT_PATH_CACHE.get(request.model_name)
+        if model_path is None:
+            # Directory lookups block, keep them off the event loop
+            model_path = await asyncio.to_thread(_resolve_snapshot_path, request.model_name)
         
-        if not os.path.exists(model_path):
+        if model_path is None:
             raise HTTPException(
                 status_code=404,
                 detail=f"Model not found at expected paths. Please ensure the model is downloaded."
             )
         
-        # Load the model
-        model_dict = load_model(request.model_name, model_path)
+        # Load the model (from_pretrained blocks; keep it off the event loop)
+        model_dict = await asyncio.to_thread(load_model, request.model_name, model_path)
         
-        # Generate text
-        output_text = generate_text(
+        # Generate text (blocking; keep it off the event loop)
+        output_text = await asyncio.to_thread(
+            generate_text,
             model_dict,
             request.input_text,
             max_length=request.max_length,
@@ -620,6 +961,8 @@ async def test_model(request: TestModelRequest):
         )
         
     except FileNotFoundError as e:
+        # A cached snapshot dir that has since been removed or replaced
+        _SNAPSHOT_PATH_CACHE.pop(request.model_name, None)
         logger.error(f"Model not found: {str(e)}")
         raise HTTPException(status_code=404, detail=str(e))
     
@@ -648,9 +991,7 @@ async def unload_model(model_name: str):
     Unload a model from cache to free memory
     """
     try:
-        if model_name in model_cache:
-            del model_cache[model_name]
-            torch.cuda.empty_cache() if torch.cuda.is_available() else None
+        if model_cache.evict(model_name):
             return {"message": f"Model {model_name} unloaded successfully"}
         else:
             raise HTTPException(status_code=404, detail=f"Model {model_name} not found in cache")
@@ -674,22 +1015,33 @@ async def test_model_simple(request: TestModelRequest):
         if not os.path.exists(model_path):
             raise HTTPException(status_code=404, detail="Model not found")
         
-        # Use pipeline for simpler inference
-        device = 0 if torch.cuda.is_available() else -1
-        
-        generator = pipeline(
-            'text-generation',
-            model=model_path,
-            tokenizer=model_path,
-            device=device
-        )
+        def build_and_generate():
+            # Reuse the entry load_model caches instead of loading a second
+            # copy of the weights; the pipeline is built once and kept on it
+            model_dict = load_model(request.model_name, model_path)
+            generator = model_dict.get('pipeline')
+            if generator is None:
+                with _loading_lock(request.model_name):
+                    generator = model_dict.get('pipeline')
+                    if generator is None:
+                        # The model is already placed on its device
+                        generator = pipeline(
+                            'text-generation',
+                            model=model_dict['model'],
+                            tokenizer=model_dict['tokenizer']
+                        )
+                        model_dict['pipeline'] = generator
+            
+            return generator(
+                request.input_text,
+                # New tokens, as in generate_text
+                max_new_tokens=request.max_length,
+                temperature=request.temperature,
+                do_sample=True
+            )
         
-        result = generator(
-            request.input_text,
-            max_length=request.max_length,
-            temperature=request.temperature,
-            do_sample=True
-        )
+        # Loading and generation both block; keep them off the event loop
+        result = await asyncio.to_thread(build_and_generate)
         
         output_text = result[0]['generated_text']
         
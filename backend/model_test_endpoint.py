@@ -5,20 +5,341 @@ This file should replace or be added to your backend/deployment_service.py
 
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import asyncio
+import copy
+import functools
+import gc
+import hashlib
+import importlib.util
+import itertools
 import os
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, pipeline
+import shutil
+import subprocess
+import tempfile
+import threading
+import weakref
 import logging
 
+from .config import config
+
+# Keep Inductor's compiled kernels and FX graphs on disk so torch.compile
+# doesn't start from scratch after every restart. Must be set before torch
+# is imported (see _import_ml)
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", "./.cache/inductor")
+os.environ.setdefault("TORCHINDUCTOR_FX_GRAPH_CACHE", "1")
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Opt-in: compile cached models on CUDA (set MODEL_COMPILE=true). Off by
+# default since the first load of each model then pays a long compile
+MODEL_COMPILE = os.getenv("MODEL_COMPILE", "false").lower() == "true"
+# Opt-in int8 weight-only quantization of cached models
+MODEL_QUANTIZE = os.getenv("MODEL_QUANTIZE", "false").lower() == "true"
+# Concurrent /test-model requests for one model are fused into a single
+# generate() call: up to MAX_BATCH prompts arriving within the window
+MAX_BATCH = int(os.getenv("MAX_BATCH", "8"))
+BATCH_WINDOW_MS = int(os.getenv("BATCH_WINDOW_MS", "15"))
+# Temperatures at or below this decode greedily: sampling would be argmax
+# anyway, so skip the top-p sort and multinomial draw
+GREEDY_TEMPERATURE = 1e-4
+
+# torch/transformers take seconds to import, so they are bound on first use
+# by _import_ml(); a worker that only serves /models/loaded never pays it
+torch = None
+AutoModelForCausalLM = AutoTokenizer = None
+quantize_ = int8_weight_only = None
+
+
+def _import_ml():
+    """Import the ML stack once and bind it to this module's globals"""
+    global torch, AutoModelForCausalLM, AutoTokenizer, quantize_, int8_weight_only
+    if torch is not None:
+        return
+    from transformers import AutoModelForCausalLM as model_cls, AutoTokenizer as tokenizer_cls
+    AutoModelForCausalLM, AutoTokenizer = model_cls, tokenizer_cls
+    try:
+        # Optional: int8 weight-only GPU kernels
+        from torchao.quantization import quantize_ as quantize_fn, int8_weight_only as int8_config
+        quantize_, int8_weight_only = quantize_fn, int8_config
+    except ImportError:
+        pass
+    # Bound last: it marks the imports as done
+    import torch as torch_module
+    torch = torch_module
+
+
+def _memory_budget() -> int:
+    """Bytes the model cache may hold: MODEL_CACHE_BUDGET_GB, else 80% of device memory"""
+    budget_gb = os.getenv("MODEL_CACHE_BUDGET_GB")
+    if budget_gb:
+        return int(float(budget_gb) * 1024 ** 3)
+    if torch.cuda.is_available():
+        return int(0.8 * torch.cuda.mem_get_info()[1])
+    return int(0.8 * os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES"))
+
+
+class ModelCache(OrderedDict):
+    """
+    Loaded models keyed by name, least recently used first. Entries are
+    evicted once their combined weight size exceeds the memory budget
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.total_bytes = 0
+        self._budget: Optional[int] = None
+        # Models are loaded from worker threads, so guard with a thread lock
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return an entry and mark it most recently used"""
+        with self._lock:
+            if key not in self:
+                return default
+            self.move_to_end(key)
+            return self[key]
+
+    def put(self, key, entry):
+        """Insert an entry, evicting least recently used ones past the budget"""
+        model = entry['model']
+        entry['nbytes'] = sum(
+            t.numel() * t.element_size()
+            for t in itertools.chain(model.parameters(), model.buffers())
+        )
+        evicted = []
+        with self._lock:
+            if self._budget is None:
+                self._budget = _memory_budget()
+            if key in self:
+                self.total_bytes -= self[key]['nbytes']
+            self[key] = entry
+            self.total_bytes += entry['nbytes']
+            # Always keep the newest entry, even if it alone is over budget
+            while self.total_bytes > self._budget and len(self) > 1:
+                name, old = self.popitem(last=False)
+                self.total_bytes -= old['nbytes']
+                evicted.append(name)
+                _stop_batcher(old)
+                del old  # don't keep the last one alive through _release()
+        if evicted:
+            logger.info(f"Evicted cached models: {evicted}")
+            self._release()
+        return entry
+
+    def evict(self, key) -> bool:
+        """Drop an entry and free its memory; False if it wasn't cached"""
+        with self._lock:
+            if key not in self:
+                return False
+            entry = self.pop(key)
+            self.total_bytes -= entry['nbytes']
+        _stop_batcher(entry)
+        del entry
+        self._release()
+        return True
+
+    @staticmethod
+    def _release():
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
 # Cache for loaded models to avoid reloading on each request
-model_cache = {}
+model_cache = ModelCache()
+
+# Tokenizers shared across cached models with identical tokenizer files
+# (e.g. fine-tunes of one base); dropped once no cached model uses them
+tokenizer_cache: "weakref.WeakValueDictionary[str, object]" = weakref.WeakValueDictionary()
+
+# A Rust fast tokenizer is not safe to call from several threads at once
+# (padding/truncation settings are mutable state), and shared ones serve
+# several models generating in parallel: one lock per tokenizer object
+_tokenizer_locks: "weakref.WeakKeyDictionary[object, threading.Lock]" = weakref.WeakKeyDictionary()
+_tokenizer_locks_guard = threading.Lock()
+
+
+def _tokenizer_lock(tokenizer) -> threading.Lock:
+    """The lock to hold while encoding with this tokenizer"""
+    with _tokenizer_locks_guard:
+        lock = _tokenizer_locks.get(tokenizer)
+        if lock is None:
+            lock = _tokenizer_locks[tokenizer] = threading.Lock()
+        return lock
+
+
+# Files that define a tokenizer's behaviour, hashed to key tokenizer_cache
+_TOKENIZER_FILES = ("tokenizer.json", "tokenizer_config.json", "special_tokens_map.json")
+
+
+def _tokenizer_fingerprint(model_path: str) -> Optional[str]:
+    """Hash of the model's tokenizer files, or None if it has no tokenizer.json"""
+    if not os.path.exists(os.path.join(model_path, "tokenizer.json")):
+        return None
+    digest = hashlib.sha256()
+    for name in _TOKENIZER_FILES:
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(name.encode())
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+# model_name -> local model directory. Only hits are cached, so a model
+# downloaded after a failed lookup is still picked up
+_path_cache: Dict[str, str] = {}
+
+
+def resolve_model_path(model_name: str) -> Optional[str]:
+    """Local directory of a downloaded model, or None if it isn't there"""
+    path = _path_cache.get(model_name)
+    if path is not None:
+        return path
+    # Adjust these paths based on your deployment structure. Typically
+    # models are stored in ./models/{model_name}, else ./downloads
+    model_name_safe = model_name.replace("/", "_")
+    for candidate in (f"./models/{model_name_safe}", f"./downloads/{model_name_safe}"):
+        if os.path.exists(candidate):
+            _path_cache[model_name] = candidate
+            return candidate
+    return None
+
+
+# One lock per model name so concurrent requests for the same uncached
+# model wait for a single load instead of each loading the weights
+_loading_locks: Dict[str, asyncio.Lock] = {}
+
+def _visible_gpu_count() -> int:
+    """Number of visible CUDA devices, found without importing torch"""
+    visible = os.getenv("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        return len([d for d in visible.split(",") if d.strip() and d.strip() != "-1"])
+    if shutil.which("nvidia-smi") is None:
+        return 0
+    try:
+        listing = subprocess.run(
+            ["nvidia-smi", "-L"], capture_output=True, text=True, timeout=10, check=True
+        ).stdout
+    except (OSError, subprocess.SubprocessError):
+        return 0
+    return sum(1 for line in listing.splitlines() if line.startswith("GPU "))
+
+
+# Worker threads for model loads and generation: one per GPU so generate()
+# calls don't contend for a device, or 2 on CPU-only hosts. Sized at import
+# (no torch needed) so creating the pool never blocks the event loop;
+# TEST_MODEL_WORKERS overrides it
+TEST_MODEL_WORKERS = int(os.getenv("TEST_MODEL_WORKERS", "0")) or (_visible_gpu_count() or 2)
+# Created on first use (see _get_executor)
+_executor: Optional[ThreadPoolExecutor] = None
+# Checkpoint dirs _convert_to_safetensors has already handled
+_converted_paths = set()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Bounded pool for model loads and generation"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=TEST_MODEL_WORKERS,
+            thread_name_prefix="test-model"
+        )
+    return _executor
+
+def _cpu_supports_bf16() -> bool:
+    """True when the CPU has native bf16 matmul support (AVX512-BF16/AMX)"""
+    check = getattr(torch.cpu, "_is_avx512_bf16_supported", None)
+    return bool(check and check())
+
+
+def _quantize_model(model, device: str):
+    """Quantize Linear weights to int8 once, before the model is cached"""
+    if device == "cuda":
+        if quantize_ is None:
+            logger.warning("MODEL_QUANTIZE is set but torchao is not installed; skipping")
+            return model
+        # Weight-only: decode is bound by weight reads, activations stay fp16
+        quantize_(model, int8_weight_only())
+        logger.info("Applied int8 weight-only quantization (torchao)")
+    elif model.dtype == torch.float32:
+        # int8 dynamic quantization of Linear weights
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+        )
+        logger.info("Applied int8 dynamic quantization")
+    return model
+
+
+def _convert_to_safetensors(model, model_path: str):
+    """
+    One-time conversion of a single-file pytorch_model.bin checkpoint to
+    model.safetensors, which later loads mmap instead of unpickling.
+    Saved from the model that was just loaded, so no second copy is built
+    """
+    bin_path = os.path.join(model_path, "pytorch_model.bin")
+    st_path = os.path.join(model_path, "model.safetensors")
+    if model_path in _converted_paths or not os.path.exists(bin_path) or os.path.exists(st_path):
+        return
+    # Attempt each path once, even if it fails (e.g. a read-only cache)
+    _converted_paths.add(model_path)
+    tmp_dir = None
+    try:
+        # save_pretrained drops tied/shared weights the way from_pretrained
+        # expects; write to a scratch dir so loads never see a partial file
+        tmp_dir = tempfile.mkdtemp(prefix=".st-convert-", dir=model_path)
+        model.save_pretrained(tmp_dir, safe_serialization=True)
+        weights = [f for f in os.listdir(tmp_dir) if f.startswith("model") and f.endswith(".safetensors")]
+        for name in weights:
+            os.replace(os.path.join(tmp_dir, name), os.path.join(model_path, name))
+        # A sharded checkpoint is only picked up once its index exists
+        index = "model.safetensors.index.json"
+        if os.path.exists(os.path.join(tmp_dir, index)):
+            os.replace(os.path.join(tmp_dir, index), os.path.join(model_path, index))
+        logger.info(f"Converted {bin_path} to safetensors")
+    except Exception as e:
+        logger.warning(f"Could not convert {bin_path} to safetensors: {e}")
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _compile_model(model, tokenizer) -> bool:
+    """
+    torch.compile the model's forward and warm it up so the compile (and
+    CUDA graph capture) cost is paid at load time, not on the first request.
+    Returns False if the model was left eager
+    """
+    import torch._inductor.config as inductor_config
+    if hasattr(inductor_config, "fx_graph_remote_cache"):
+        # Local disk cache only
+        inductor_config.fx_graph_remote_cache = False
+    
+    eager_forward = model.forward
+    with _tokenizer_lock(tokenizer):
+        warmup_inputs = tokenizer("warmup", return_tensors="pt").to(model.device)
+    # Patch forward rather than wrapping the module so generate() still
+    # goes through the compiled graph
+    for mode in ("reduce-overhead", "default"):
+        try:
+            model.forward = torch.compile(eager_forward, mode=mode, dynamic=True)
+            with torch.inference_mode():
+                model(**warmup_inputs)
+            logger.info(f"Compiled model with mode={mode}")
+            return True
+        except Exception as e:
+            logger.warning(f"torch.compile(mode={mode}) failed, falling back: {e}")
+    model.forward = eager_forward
+    return False
+
 
 class TestModelRequest(BaseModel):
     model_name: str
@@ -41,50 +362,117 @@ def load_model(model_name: str, model_path: str):
     cache_key = model_name
     
     # Return cached model if already loaded
-    if cache_key in model_cache:
+    cached = model_cache.get(cache_key)
+    if cached is not None:
         logger.info(f"Using cached model: {model_name}")
-        return model_cache[cache_key]
+        return cached
     
     try:
+        _import_ml()
         logger.info(f"Loading model from: {model_path}")
         
         # Check if model files exist
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model path does not exist: {model_path}")
         
-        # Load tokenizer and model
-        tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True)
-        
-        # Set pad token if not exists
-        if tokenizer.pad_token is None:
-            tokenizer.pad_token = tokenizer.eos_token
+        # Load tokenizer (or reuse an identical one) and model
+        tok_key = _tokenizer_fingerprint(model_path)
+        tokenizer = tokenizer_cache.get(tok_key) if tok_key else None
+        if tokenizer is None:
+            tokenizer = AutoTokenizer.from_pretrained(model_path, local_files_only=True)
+            
+            # Set pad token if not exists
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            # Causal LMs continue from the last position, so any padding goes left
+            tokenizer.padding_side = "left"
+            
+            if tok_key:
+                tokenizer_cache[tok_key] = tokenizer
         
         # Determine device
         device = "cuda" if torch.cuda.is_available() else "cpu"
         logger.info(f"Using device: {device}")
         
-        # Load model
-        model = AutoModelForCausalLM.from_pretrained(
-            model_path,
+        # Half precision halves the bytes moved per decode step; on CPU only
+        # when bf16 is native, emulated bf16 is slower than fp32
+        if device == "cuda":
+            compute_dtype = torch.float16
+        elif _cpu_supports_bf16():
+            compute_dtype = torch.bfloat16
+        else:
+            compute_dtype = torch.float32
+        
+        load_kwargs = dict(
             local_files_only=True,
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            torch_dtype=compute_dtype,
+            # Safetensors shards are mmap'd and streamed to the target
+            # device instead of being read fully into host RAM first
+            low_cpu_mem_usage=True,
             device_map="auto" if device == "cuda" else None
         )
         
+        # Load model, with fused FlashAttention-2 kernels on Ampere+ when
+        # flash-attn is installed and the architecture supports it
+        model = None
+        if (device == "cuda" and torch.cuda.get_device_capability()[0] >= 8
+                and importlib.util.find_spec("flash_attn") is not None):
+            try:
+                model = AutoModelForCausalLM.from_pretrained(
+                    model_path, use_flash_attention_2=True, **load_kwargs
+                )
+            except (ValueError, ImportError) as e:
+                logger.info(f"FlashAttention-2 unavailable for {model_name}, using default attention: {e}")
+        if model is None:
+            model = AutoModelForCausalLM.from_pretrained(model_path, **load_kwargs)
+        
+        # Checkpoints that only ship a .bin get a safetensors copy for next
+        # time. Done here, before quantize/compile change the weights, and
+        # under the model's loading lock so no other load reads the dir
+        _convert_to_safetensors(model, model_path)
+        
         if device == "cpu":
             model = model.to(device)
         
         model.eval()  # Set to evaluation mode
         
+        if MODEL_QUANTIZE:
+            model = _quantize_model(model, device)
+        
+        # torchao's int8 kernels are meant to run under compile, so
+        # quantize first
+        compiled = MODEL_COMPILE and device == "cuda" and _compile_model(model, tokenizer)
+        
+        # Autocast only if the weights didn't come out in the compute dtype,
+        # otherwise it would just add casts
+        autocast_dtype = None
+        if compute_dtype != torch.float32 and model.dtype != compute_dtype:
+            autocast_dtype = compute_dtype
+        
+        # Fixed sampling settings, resolved once instead of per generate()
+        gen_config = copy.deepcopy(model.generation_config)
+        gen_config.update(
+            do_sample=True,
+            top_p=0.9,
+            # Reuse past keys/values so each decode step only attends the new token
+            use_cache=True,
+            pad_token_id=tokenizer.pad_token_id,
+            eos_token_id=tokenizer.eos_token_id
+        )
+        
         # Cache the model and tokenizer
-        model_cache[cache_key] = {
+        model_dict = model_cache.put(cache_key, {
             'model': model,
             'tokenizer': tokenizer,
-            'device': device
-        }
+            'tok_key': tok_key,
+            'device': device,
+            'autocast_dtype': autocast_dtype,
+            'compiled': compiled,
+            'gen_config': gen_config
+        })
         
         logger.info(f"Successfully loaded model: {model_name}")
-        return model_cache[cache_key]
+        return model_dict
         
     except Exception as e:
         logger.error(f"Error loading model {model_name}: {str(e)}")
@@ -95,37 +483,157 @@ def generate_text(model_dict, input_text: str, max_length: int = 100, temperatur
     """
     Generate text using the loaded model
     """
+    return generate_texts(model_dict, [input_text], max_length, temperature)[0]
+
+
+def generate_texts(model_dict, prompts: List[str], max_length: int = 100, temperature: float = 0.7) -> List[str]:
+    """
+    Generate text for a batch of prompts in a single generate() call
+    """
     try:
         model = model_dict['model']
         tokenizer = model_dict['tokenizer']
         device = model_dict['device']
         
-        # Tokenize input
-        inputs = tokenizer(input_text, return_tensors="pt", padding=True)
-        inputs = {k: v.to(device) for k, v in inputs.items()}
+        # max_length budgets new tokens, as in deployment_service, so every
+        # prompt in a batch gets the same budget however long it is
+        max_new_tokens = max(max_length if max_length is not None else 100, 1)
+        
+        # Tokenize input (left-padded to the longest prompt). The tokenizer
+        # may be shared with other models, so encode under its lock
+        with _tokenizer_lock(tokenizer):
+            encoded = tokenizer(prompts)
+            prompt_len = max(len(ids) for ids in encoded["input_ids"])
+            if model_dict['compiled']:
+                # Pad to a power-of-two bucket (min 32) so the compiled model and
+                # its captured CUDA graphs only ever see a handful of shapes;
+                # eager models gain nothing from fixed shapes
+                bucket = max(32, 1 << (prompt_len - 1).bit_length())
+                # Never pad past the position embeddings; fall back to the
+                # longest prompt when the bucket doesn't fit
+                max_positions = getattr(model.config, "max_position_embeddings", None) or getattr(model.config, "n_positions", None)
+                if max_positions is not None:
+                    bucket = min(bucket, max_positions - max_new_tokens)
+                if bucket >= prompt_len:
+                    inputs = tokenizer.pad(encoded, padding="max_length", max_length=bucket, return_tensors="pt")
+                else:
+                    inputs = tokenizer.pad(encoded, padding="longest", return_tensors="pt")
+            else:
+                inputs = tokenizer.pad(encoded, padding="longest", return_tensors="pt")
+        
+        if device == "cuda":
+            # Pinned host memory so the copies are async and overlap with
+            # the remaining Python work
+            inputs = {k: v.pin_memory().to(device, non_blocking=True) for k, v in inputs.items()}
+        else:
+            inputs = {k: v.to(device) for k, v in inputs.items()}
+        
+        autocast_dtype = model_dict['autocast_dtype']
+        autocast = (
+            torch.autocast(device_type=device, dtype=autocast_dtype)
+            if autocast_dtype is not None else nullcontext()
+        )
+        
+        if temperature is not None and temperature <= GREEDY_TEMPERATURE:
+            # Neutral temperature/top_p so generate() doesn't warn about
+            # sampling settings it ignores
+            decoding = dict(do_sample=False, num_beams=1, temperature=1.0, top_p=1.0)
+        else:
+            decoding = dict(temperature=temperature)
         
         # Generate output
-        with torch.no_grad():
+        with torch.inference_mode(), autocast:
             output_ids = model.generate(
                 **inputs,
-                max_length=max_length,
-                temperature=temperature,
-                do_sample=True,
-                top_p=0.9,
-                pad_token_id=tokenizer.pad_token_id,
-                eos_token_id=tokenizer.eos_token_id
+                generation_config=model_dict['gen_config'],
+                max_new_tokens=max_new_tokens,
+                **decoding
             )
         
         # Decode output
-        generated_text = tokenizer.decode(output_ids[0], skip_special_tokens=True)
-        
-        return generated_text
+        return tokenizer.batch_decode(output_ids, skip_special_tokens=True)
         
     except Exception as e:
         logger.error(f"Error generating text: {str(e)}")
         raise
 
 
+def _ensure_batcher(model_name: str, model_dict) -> asyncio.Queue:
+    """Start the model's batch worker if it isn't running and return its queue"""
+    # An entry evicted since it was looked up must not get a new worker,
+    # which would keep its weights alive
+    if model_cache.get(model_name) is not model_dict:
+        raise RuntimeError("Model was unloaded")
+    task = model_dict.get('batch_task')
+    if task is None or task.done():
+        # Keep the queue of a worker that died so the requests still in it
+        # are served by its replacement instead of timing out
+        if model_dict.get('batch_queue') is None:
+            model_dict['batch_queue'] = asyncio.Queue()
+        model_dict['batch_task'] = asyncio.create_task(_batch_worker(model_dict))
+    return model_dict['batch_queue']
+
+
+def _stop_batcher(model_dict):
+    """Cancel a model's batch worker; safe to call from any thread"""
+    task = model_dict.get('batch_task')
+    if task is not None:
+        task.get_loop().call_soon_threadsafe(task.cancel)
+
+
+async def _batch_worker(model_dict):
+    """Collect prompts arriving within the batch window and generate them together"""
+    queue = model_dict['batch_queue']
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + BATCH_WINDOW_MS / 1000
+            while len(batch) < MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Only requests with the same generation settings can share a call
+            groups: Dict[tuple, list] = {}
+            for prompt, params, future in batch:
+                groups.setdefault(params, []).append((prompt, future))
+            
+            for (max_length, temperature), items in groups.items():
+                try:
+                    outputs = await loop.run_in_executor(
+                        _get_executor(),
+                        functools.partial(
+                            generate_texts,
+                            model_dict,
+                            [prompt for prompt, _ in items],
+                            max_length=max_length,
+                            temperature=temperature
+                        )
+                    )
+                except Exception as e:
+                    for _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_, future), output in zip(items, outputs):
+                    if not future.done():
+                        future.set_result(output)
+    except asyncio.CancelledError:
+        # Model was evicted/unloaded: fail whatever is still waiting
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        for _, _, future in batch:
+            if not future.done():
+                future.set_exception(RuntimeError("Model was unloaded"))
+        raise
+
+
 @router.post("/test-model", response_model=TestModelResponse)
 async def test_model(request: TestModelRequest):
     """
@@ -134,40 +642,57 @@ async def test_model(request: TestModelRequest):
     try:
         logger.info(f"Testing model: {request.model_name} with input: {request.input_text}")
         
-        # Construct model path
-        # Adjust this path based on your deployment structure
-        # Typically models are stored in ./models/{model_name}
-        model_name_safe = request.model_name.replace("/", "_")
-        model_path = f"./models/{model_name_safe}"
+        # Load the model (blocking, so off the event loop), once per name
+        model_dict = model_cache.get(request.model_name)
+        if model_dict is None:
+            # Only a cache miss needs the model's location on disk
+            model_path = _path_cache.get(request.model_name)
+            if model_path is None:
+                model_path = await asyncio.to_thread(resolve_model_path, request.model_name)
+            if model_path is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail=f"Model not found at expected paths. Please ensure the model is downloaded."
+                )
+            
+            lock = _loading_locks.setdefault(request.model_name, asyncio.Lock())
+            async with lock:
+                model_dict = model_cache.get(request.model_name)
+                if model_dict is None:
+                    model_dict = await asyncio.get_running_loop().run_in_executor(
+                        _get_executor(), load_model, request.model_name, model_path
+                    )
         
-        # Alternative path structure - adjust as needed
-        if not os.path.exists(model_path):
-            model_path = f"./downloads/{model_name_safe}"
-        
-        if not os.path.exists(model_path):
+        # Generate text: queue the prompt for the model's batch worker.
+        # All near-zero temperatures take the same greedy path, so let
+        # them share a batch
+        temperature = request.temperature
+        if temperature is not None and temperature <= GREEDY_TEMPERATURE:
+            temperature = 0.0
+        future = asyncio.get_running_loop().create_future()
+        _ensure_batcher(request.model_name, model_dict).put_nowait(
+            (request.input_text, (request.max_length, temperature), future)
+        )
+        try:
+            output_text = await asyncio.wait_for(future, timeout=config.MODEL_INFERENCE_TIMEOUT)
+        except asyncio.TimeoutError:
             raise HTTPException(
-                status_code=404,
-                detail=f"Model not found at expected paths. Please ensure the model is downloaded."
+                status_code=504,
+                detail=f"Inference timed out after {config.MODEL_INFERENCE_TIMEOUT} seconds"
             )
         
-        # Load the model
-        model_dict = load_model(request.model_name, model_path)
-        
-        # Generate text
-        output_text = generate_text(
-            model_dict,
-            request.input_text,
-            max_length=request.max_length,
-            temperature=request.temperature
-        )
-        
         return TestModelResponse(
             output=output_text,
             model_name=request.model_name,
             status="success"
         )
         
+    except HTTPException:
+        raise
+    
     except FileNotFoundError as e:
+        # A cached path whose files have since been removed
+        _path_cache.pop(request.model_name, None)
         logger.error(f"Model not found: {str(e)}")
         raise HTTPException(status_code=404, detail=str(e))
     
@@ -196,9 +721,7 @@ async def unload_model(model_name: str):
     Unload a model from cache to free memory
     """
     try:
-        if model_name in model_cache:
-            del model_cache[model_name]
-            torch.cuda.empty_cache() if torch.cuda.is_available() else None
+        if model_cache.evict(model_name):
             return {"message": f"Model {model_name} unloaded successfully"}
         else:
             raise HTTPException(status_code=404, detail=f"Model {model_name} not found in cache")
@@ -206,47 +729,11 @@ async def unload_model(model_name: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# Alternative simpler endpoint using pipeline API
-@router.post("/test-model-simple")
+# Kept for existing clients; shares test_model's cached models
+@router.post("/test-model-simple", deprecated=True)
 async def test_model_simple(request: TestModelRequest):
     """
-    Simplified version using transformers pipeline
+    Simplified version, now an alias of /test-model. It used to build a
+    transformers pipeline (reloading the model from disk) on every request
     """
-    try:
-        model_name_safe = request.model_name.replace("/", "_")
-        model_path = f"./models/{model_name_safe}"
-        
-        if not os.path.exists(model_path):
-            model_path = f"./downloads/{model_name_safe}"
-        
-        if not os.path.exists(model_path):
-            raise HTTPException(status_code=404, detail="Model not found")
-        
-        # Use pipeline for simpler inference
-        device = 0 if torch.cuda.is_available() else -1
-        
-        generator = pipeline(
-            'text-generation',
-            model=model_path,
-            tokenizer=model_path,
-            device=device
-        )
-        
-        result = generator(
-            request.input_text,
-            max_length=request.max_length,
-            temperature=request.temperature,
-            do_sample=True
-        )
-        
-        output_text = result[0]['generated_text']
-        
-        return TestModelResponse(
-            output=output_text,
-            model_name=request.model_name,
-            status="success"
-        )
-        
-    except Exception as e:
-        logger.error(f"Error in simple test: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return await test_model(request)
@@ -3,20 +3,20 @@
 Test script for API server
 Verifies all endpoints are working correctly
 """
-import requests
+import asyncio
+import httpx
 import json
-import time
 from pathlib import Path
 
 # Configuration
 BASE_URL = "http://localhost:8000"
 TEST_TIMEOUT = 5
 
-def test_health():
+async def test_health(client: httpx.AsyncClient):
     """Test health endpoint"""
     print("\n🔍 Testing /health endpoint...")
     try:
-        response = requests.get(f"{BASE_URL}/health", timeout=TEST_TIMEOUT)
+        response = await client.get("/health")
         if response.status_code == 200:
             data = response.json()
             print("✅ Health check passed")
@@ -31,11 +31,11 @@ def test_health():
         return False
 
 
-def test_system_info():
+async def test_system_info(client: httpx.AsyncClient):
     """Test system info endpoint"""
     print("\n🔍 Testing /api/system/info endpoint...")
     try:
-        response = requests.get(f"{BASE_URL}/api/system/info", timeout=TEST_TIMEOUT)
+        response = await client.get("/api/system/info")
         if response.status_code == 200:
             data = response.json()
             print("✅ System info retrieved")
@@ -51,11 +51,11 @@ def test_system_info():
         return False
 
 
-def test_list_deployments():
+async def test_list_deployments(client: httpx.AsyncClient):
     """Test list deployments endpoint"""
     print("\n🔍 Testing /api/deployments endpoint...")
     try:
-        response = requests.get(f"{BASE_URL}/api/deployments", timeout=TEST_TIMEOUT)
+        response = await client.get("/api/deployments")
         if response.status_code == 200:
             data = response.json()
             print("✅ Deployments listed")
@@ -72,7 +72,7 @@ def test_list_deployments():
         return False
 
 
-def test_deploy_model():
+async def test_deploy_model(client: httpx.AsyncClient):
     """Test model deployment"""
     print("\n🔍 Testing /api/deploy endpoint...")
     try:
@@ -86,11 +86,7 @@ def test_deploy_model():
             "dependencies": []
         }
         
-        response = requests.post(
-            f"{BASE_URL}/api/deploy",
-            json=payload,
-            timeout=TEST_TIMEOUT
-        )
+        response = await client.post("/api/deploy", json=payload)
         
         if response.status_code == 200:
             data = response.json()
@@ -102,10 +98,10 @@ def test_deploy_model():
             
             # Wait for server to start
             print("\n⏳ Waiting for model server to start...")
-            time.sleep(5)
+            await asyncio.sleep(5)
             
             # Test the deployed model
-            test_deployed_model(data['port'], data['deployment_id'])
+            await test_deployed_model(client, data['port'], data['deployment_id'])
             
             return data['deployment_id']
         else:
@@ -117,22 +113,21 @@ def test_deploy_model():
         return None
 
 
-def test_deployed_model(port, deployment_id):
+async def test_deployed_model(client: httpx.AsyncClient, port, deployment_id):
     """Test the deployed model endpoints"""
     print(f"\n🔍 Testing deployed model on port {port}...")
     model_url = f"http://localhost:{port}"
     
     try:
         # Test health
-        response = requests.get(f"{model_url}/health", timeout=TEST_TIMEOUT)
+        response = await client.get(f"{model_url}/health")
         if response.status_code == 200:
             print("✅ Model health check passed")
         
         # Test prediction
-        response = requests.post(
+        response = await client.post(
             f"{model_url}/predict",
-            json={"data": [[1.0, 2.0, 3.0, 4.0]]},
-            timeout=TEST_TIMEOUT
+            json={"data": [[1.0, 2.0, 3.0, 4.0]]}
         )
         if response.status_code == 200:
             data = response.json()
@@ -140,7 +135,7 @@ def test_deployed_model(port, deployment_id):
             print(f"   Inference time: {data.get('inference_time_ms', 'N/A')} ms")
         
         # Test model info
-        response = requests.get(f"{model_url}/model/info", timeout=TEST_TIMEOUT)
+        response = await client.get(f"{model_url}/model/info")
         if response.status_code == 200:
             data = response.json()
             print("✅ Model info retrieved")
@@ -151,7 +146,7 @@ def test_deployed_model(port, deployment_id):
         print(f"⚠️  Some model endpoints failed: {e}")
 
 
-def test_stop_deployment(deployment_id):
+async def test_stop_deployment(client: httpx.AsyncClient, deployment_id):
     """Test stopping a deployment"""
     if not deployment_id:
         print("\n⏭️  Skipping stop test (no deployment ID)")
@@ -159,10 +154,7 @@ def test_stop_deployment(deployment_id):
     
     print(f"\n🔍 Testing stop deployment for ID: {deployment_id}...")
     try:
-        response = requests.delete(
-            f"{BASE_URL}/api/deployments/{deployment_id}",
-            timeout=TEST_TIMEOUT
-        )
+        response = await client.delete(f"/api/deployments/{deployment_id}")
         
         if response.status_code == 200:
             print("✅ Deployment stopped successfully")
@@ -175,7 +167,7 @@ def test_stop_deployment(deployment_id):
         return False
 
 
-def run_all_tests():
+async def run_all_tests():
     """Run all tests"""
     print("=" * 60)
     print("🧪 Starting API Server Tests")
@@ -192,15 +184,24 @@ def run_all_tests():
     }
     
     # Run tests
-    results["health"] = test_health()
-    results["system_info"] = test_system_info()
-    results["list_deployments"] = test_list_deployments()
-    
-    deployment_id = test_deploy_model()
-    results["deploy"] = deployment_id is not None
-    
-    if deployment_id:
-        results["stop"] = test_stop_deployment(deployment_id)
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=TEST_TIMEOUT) as client:
+        # Independent probes run concurrently
+        (
+            results["health"],
+            results["system_info"],
+            results["list_deployments"],
+        ) = await asyncio.gather(
+            test_health(client),
+            test_system_info(client),
+            test_list_deployments(client),
+        )
+        
+        # deploy -> test deployed model -> stop depend on each other
+        deployment_id = await test_deploy_model(client)
+        results["deploy"] = deployment_id is not None
+        
+        if deployment_id:
+            results["stop"] = await test_stop_deployment(client, deployment_id)
     
     # Summary
     print("\n" + "=" * 60)
@@ -229,7 +230,7 @@ def run_all_tests():
 
 if __name__ == "__main__":
     try:
-        success = run_all_tests()
+        success = asyncio.run(run_all_tests())
         exit(0 if success else 1)
     except KeyboardInterrupt:
         print("\n\n⚠️  Tests interrupted by user")
@@ -46,9 +46,7 @@ export default function DeploymentProgress({ deploymentData, onComplete, onCance
         }, 10000)
       }
 
-      ws.onmessage = (event) => {
-        const data = JSON.parse(event.data)
-        
+      const handleMessage = (data) => {
         // Ignore heartbeat messages
         if (data.type === 'heartbeat') {
           return
@@ -64,6 +62,17 @@ export default function DeploymentProgress({ deploymentData, onComplete, onCance
         }
       }
 
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data)
+
+        // Messages queued up on the server arrive merged into one frame
+        if (data.type === 'batch') {
+          data.items.forEach(handleMessage)
+        } else {
+          handleMessage(data)
+        }
+      }
+
       ws.onerror = (error) => {
         console.error('WebSocket error:', error)
         setError('Connection error occurred. Please check the backend server.')